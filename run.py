@@ -1,5 +1,10 @@
 from main_file import main_run
 import asyncio
 
+try:
+    import uvloop # Faster event loop where available; not supported on Windows
+except ImportError:
+    uvloop = None
+
 if __name__ == "__main__":
-    asyncio.run(main_run())
+    asyncio.run(main_run(), loop_factory=uvloop.new_event_loop if uvloop else None)
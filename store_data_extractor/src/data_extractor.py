@@ -1,14 +1,17 @@
-from typing import List, Optional, Any, Tuple
+from typing import Callable, Dict, List, Optional, Any, Tuple
+from functools import lru_cache
 import random
 from lxml import html
-from lxml.etree import XPathError
+from lxml.cssselect import CSSSelector
+from lxml.etree import LxmlError, XPath, XPathError
 from datetime import datetime
-from aiohttp import ClientResponseError, ClientSession
+from aiohttp import ClientResponseError, ClientSession, ClientTimeout
 from charset_normalizer import from_bytes
 from curl_cffi import requests as curl_requests
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit, urlunsplit
 import certifi
 import asyncio
+import codecs
 import ssl
 import logging
 import re
@@ -18,18 +21,38 @@ from store_data_extractor.store_types import StoreConfigDataType, StoreOptionsDa
 
 logger = logging.getLogger("DataExtractor")
 
-async def get_page_content(url: str, session: Any, store: StoreOptionsDataType) -> Optional[str]:
-    """Fetch the HTML content of a page using a rotating user agent."""
-    agent: str = await next_user_agent()
+# Shared TLS context; loading the certifi CA bundle is too costly to repeat per request
+SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where())
+
+DEFAULT_REQUEST_TIMEOUT = 30 # Seconds per request unless the store sets request_timeout
+
+STREAM_CHUNK_SIZE = 65536 # Bytes read from the response stream per parser feed
+
+# Idle feed parsers reused across pages; a parser is popped while a page streams into it
+HTML_PARSER_POOL: List[html.HTMLParser] = []
+
+# Price patterns and parsers per supported currency, compiled once at import
+PRICE_PATTERNS: dict[str, re.Pattern[str]] = {
+    "JPY": re.compile(r"[\d,]+"),
+    "EUR": re.compile(r"[\d.,]+"),
+}
+PRICE_PARSERS: dict[str, Callable[[str], float]] = {
+    "JPY": lambda price: float(price.replace(",", "")),
+    "EUR": lambda price: float(price.replace(",", "").replace(".", "")) / 100,
+}
+
+async def get_page_content(url: str, session: Any, store: StoreOptionsDataType) -> Optional[html.HtmlElement]:
+    """Fetch and parse a page using a rotating user agent."""
+    agent: str = next_user_agent()
     logger.info(f"Fetching page {url} with user agent: {agent}")
 
     headers = build_request_headers(agent, store)
     fetch_backend = store.get("fetch_backend", "auto")
 
     if fetch_backend in ("auto", "aiohttp"):
-        content = await get_page_content_with_aiohttp(url, session, store, headers)
-        if content or fetch_backend == "aiohttp":
-            return content
+        tree = await get_page_content_with_aiohttp(url, session, store, headers)
+        if tree is not None or fetch_backend == "aiohttp":
+            return tree
 
     if fetch_backend in ("auto", "curl_cffi"):
         return await get_page_content_with_curl_cffi(url, store, headers)
@@ -42,14 +65,15 @@ async def get_page_content_with_aiohttp(
     session: Any,
     store: StoreOptionsDataType,
     headers: dict[str, str],
-) -> Optional[str]:
+) -> Optional[html.HtmlElement]:
     try:
-        context = ssl.create_default_context(cafile=certifi.where())
         proxy_url = store.get("proxy_url")
 
-        async with session.get(url, headers=headers, proxy=proxy_url, ssl=context) as response:
+        # TLS uses SSL_CONTEXT configured on the session connector
+        timeout = ClientTimeout(total=store.get("request_timeout", DEFAULT_REQUEST_TIMEOUT))
+        async with session.get(url, headers=headers, proxy=proxy_url, timeout=timeout) as response:
             response.raise_for_status()
-            return decode_page_content(await response.read(), store)
+            return await parse_response_stream(response, store)
     except ClientResponseError as e:
         logger.warning(f"aiohttp fetch failed for {url}: {e.status}, message='{e.message}'")
     except Exception as e:
@@ -61,27 +85,66 @@ async def get_page_content_with_curl_cffi(
     url: str,
     store: StoreOptionsDataType,
     headers: dict[str, str],
-) -> Optional[str]:
+) -> Optional[html.HtmlElement]:
     try:
         return await asyncio.to_thread(fetch_page_with_curl_cffi, url, store, headers)
     except Exception as e:
         logger.error(f"curl_cffi fetch failed for {url}: {e}")
         return None
 
-def fetch_page_with_curl_cffi(url: str, store: StoreOptionsDataType, headers: dict[str, str]) -> Optional[str]:
+def fetch_page_with_curl_cffi(url: str, store: StoreOptionsDataType, headers: dict[str, str]) -> Optional[html.HtmlElement]:
     response = curl_requests.get(
         url,
         headers=headers,
         impersonate=store.get("curl_impersonate", "chrome"),
         proxy=store.get("proxy_url"),
-        timeout=store.get("request_timeout", 30),
+        timeout=store.get("request_timeout", DEFAULT_REQUEST_TIMEOUT),
     )
 
     if response.status_code >= 400:
         logger.error(f"curl_cffi fetch failed for {url}: HTTP {response.status_code}")
         return None
 
-    return decode_page_content(response.content, store)
+    return parse_html_document(decode_page_content(response.content, store))
+
+async def parse_response_stream(response: Any, store: StoreOptionsDataType) -> Optional[html.HtmlElement]:
+    """Decode and parse the response body chunk by chunk while it downloads."""
+    raw_chunks: List[bytes] = []
+    parser = HTML_PARSER_POOL.pop() if HTML_PARSER_POOL else html.HTMLParser() # Same options as the parser html.fromstring uses
+    parser_closed = False
+    try:
+        try:
+            decoder = codecs.getincrementaldecoder(store.get("encoding", "utf-8"))()
+            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                raw_chunks.append(chunk)
+                parser.feed(decoder.decode(chunk))
+            parser.feed(decoder.decode(b"", final=True))
+        except (LookupError, UnicodeDecodeError):
+            # Read the rest of the body and let decode_page_content detect the encoding
+            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                raw_chunks.append(chunk)
+            return parse_html_document(decode_page_content(b"".join(raw_chunks), store))
+
+        parser_closed = True
+        return parser.close()
+    except LxmlError as e:
+        logger.warning(f"Failed to parse page content: {e}")
+        return None
+    finally:
+        if not parser_closed:
+            try:
+                parser.close() # Discard the unfinished document before reuse
+            except LxmlError:
+                pass
+        HTML_PARSER_POOL.append(parser)
+
+def parse_html_document(content: str) -> Optional[html.HtmlElement]:
+    """Parse decoded page content, returning None for empty or unparsable pages."""
+    try:
+        return html.fromstring(content)
+    except LxmlError as e:
+        logger.warning(f"Failed to parse page content: {e}")
+        return None
 
 def decode_page_content(raw_content: bytes, store: StoreOptionsDataType) -> str:
     encoding = store.get("encoding", "utf-8")
@@ -116,13 +179,13 @@ def build_request_headers(agent: str, store: StoreOptionsDataType) -> dict[str,
     return headers
 
 
-async def try_get_page_content(url: str, session: Any, store: StoreOptionsDataType, max_retries: int = 3) -> Optional[str]:
-    """Try to get page content with retries."""
+async def try_get_page_content(url: str, session: Any, store: StoreOptionsDataType, max_retries: int = 3) -> Optional[html.HtmlElement]:
+    """Try to get the parsed page with retries."""
     for attempt in range(max_retries):
         try:
-            content = await get_page_content(url, session, store)
-            if content:
-                return content
+            tree = await get_page_content(url, session, store)
+            if tree is not None:
+                return tree
             logger.warning(f"Attempt {attempt + 1}/{max_retries} failed to get content from {url}")
         except Exception as e:
             logger.warning(f"Attempt {attempt + 1}/{max_retries} failed with error: {e}")
@@ -136,38 +199,46 @@ def parse_prices(price_text: str, price_config) -> ProductPricesDataType:
     """Parse price information from the price string."""
     prices: ProductPricesDataType = {}
     try:
-        price_text = price_text.strip()
-        if price_config["currency"] == "JPY":
-            match = re.search(r"[\d,]+", price_text)
-            if match:
-                cleaned_price = match.group(0).replace(",", "")
-                prices["JPY"] = float(cleaned_price)
-        elif price_config["currency"] == "EUR":
-            match = re.search(r"[\d.,]+", price_text)
-            if match:
-                cleaned_price = match.group(0).replace(",", "").replace(".", "")
-                prices["EUR"] = float(cleaned_price) / 100
+        currency = price_config["currency"]
+        price_pattern = PRICE_PATTERNS.get(currency)
+        if price_pattern is None:
+            return prices
+
+        match = price_pattern.search(price_text)
+        if match:
+            prices[currency] = PRICE_PARSERS[currency](match.group(0))
     except Exception as e:
         logger.error(f"Error parsing price: {e}")
 
     return prices
 
+@lru_cache(maxsize=512)
+def compile_selector(selector: str) -> Callable[[Any], List[Any]]:
+    """Compile a selector once as XPath by default, or CSS when forced or when XPath fails to parse."""
+    if selector.startswith("xpath:"):
+        return XPath(selector.removeprefix("xpath:").strip())
+
+    if selector.startswith("css:"):
+        return CSSSelector(selector.removeprefix("css:").strip(), translator="html")
+
+    try:
+        return XPath(selector)
+    except XPathError:
+        return CSSSelector(selector, translator="html")
+
 def select_values(node: Any, selector: str) -> List[Any]:
     """Evaluate a selector as XPath by default, with CSS support for store configs."""
     selector = selector.strip()
     if not selector:
         return []
 
-    if selector.startswith("xpath:"):
-        return list(node.xpath(selector.removeprefix("xpath:").strip()))
-
-    if selector.startswith("css:"):
-        return list(node.cssselect(selector.removeprefix("css:").strip()))
-
     try:
-        return list(node.xpath(selector))
+        return list(compile_selector(selector)(node))
     except XPathError:
-        return list(node.cssselect(selector))
+        if selector.startswith("xpath:"):
+            raise
+        # Valid XPath syntax can still fail at evaluation time (e.g. "a:hover" as an unknown prefix)
+        return list(compile_selector(f"css:{selector}")(node))
 
 def format_selector_value(value: Any, attribute: Optional[str] = None) -> Optional[str]:
     if isinstance(value, str):
@@ -265,9 +336,7 @@ def check_sold_out(product, sold_out_selector) -> bool:
 async def compare_with_database(database: StoreDatabase, store_name: str, current_urls: set[str]) -> set[str]:
     """Compare current products with database and return URLs that should be archived."""
     try:
-        db_products = await database.get_products(store_name)
-        db_urls = {p["product_url"] for p in db_products if not p.get("archived", False)}
-        to_archive = db_urls - current_urls # URLs in DB but not in current URLs
+        to_archive = await database.get_urls_to_archive(store_name, current_urls) # URLs in DB but not in current URLs
         logger.info(f"Found {len(to_archive)} products to archive")
         return to_archive
     except Exception as e:
@@ -331,6 +400,91 @@ async def get_next_page_url_by_config(tree: html.HtmlElement, store: StoreOption
         logger.error(f"Error finding next page for {store['base_url']}: {e}")
         return None
 
+async def extract_page(tree: html.HtmlElement, store: StoreOptionsDataType) -> Tuple[List[ProductDataType], Optional[str]]:
+    """Return a page's items and next page URL so the caller can release the page tree."""
+    body = get_body_element(tree)
+
+    page_items = await extract_items_by_config(body, store)
+    next_url = await get_next_page_url_by_config(body, store)
+    return page_items, next_url
+
+def find_page_parameter(current_url: str, next_url: str) -> Optional[Tuple[str, int]]:
+    """Return the query parameter and page number when next_url only increments a numeric page parameter."""
+    current_parts, next_parts = urlsplit(current_url), urlsplit(next_url)
+    if current_parts._replace(query="") != next_parts._replace(query=""):
+        return None
+
+    current_query = dict(pair.partition("=")[::2] for pair in current_parts.query.split("&") if pair)
+    next_query = dict(pair.partition("=")[::2] for pair in next_parts.query.split("&") if pair)
+    changed = [key for key in next_query if current_query.get(key) != next_query[key]]
+    if len(changed) != 1 or current_query.keys() - next_query.keys():
+        return None
+
+    parameter = changed[0]
+    current_page = current_query.get(parameter, "1") # First pages often omit the page parameter
+    next_page = next_query[parameter]
+    if not (current_page.isdigit() and next_page.isdigit()) or int(next_page) != int(current_page) + 1:
+        return None
+
+    return parameter, int(next_page)
+
+def build_page_url(url: str, parameter: str, page: int) -> str:
+    """Replace the value of a page query parameter, keeping the rest of the URL untouched."""
+    parts = urlsplit(url)
+    query = "&".join(
+        f"{parameter}={page}" if pair.partition("=")[0] == parameter else pair
+        for pair in parts.query.split("&")
+    )
+    return urlunsplit(parts._replace(query=query))
+
+async def prefetch_pages(
+    session: Any,
+    store: StoreOptionsDataType,
+    current_url: str,
+    next_url: str,
+) -> Tuple[Dict[str, html.HtmlElement], set[str]]:
+    """
+    Fetch upcoming pages concurrently when the pagination URL follows a numeric page parameter.
+    Requests start one delay apart, so the pace matches sequential fetching while responses overlap.
+    No further pages are requested once a page fails or has no next link.
+    Returns the fetched pages by URL and the set of URLs that were requested.
+    """
+    page_concurrency = store.get("page_concurrency", 1)
+    page_parameter = find_page_parameter(current_url, next_url)
+    if page_concurrency <= 1 or page_parameter is None:
+        return {}, set()
+
+    parameter, next_page = page_parameter
+    page_urls = [build_page_url(next_url, parameter, page) for page in range(next_page, next_page + page_concurrency)]
+    delay = store.get("delay_between_requests", 5)
+    page_trees: Dict[str, html.HtmlElement] = {}
+    requested_urls: set[str] = set()
+    last_page_reached = False
+
+    async def fetch_page(page_url: str) -> None:
+        nonlocal last_page_reached
+        try:
+            # Single attempt; main_program refetches a failed page with retries
+            page_tree = await get_page_content(page_url, session, store)
+            if page_tree is None or not await get_next_page_url_by_config(page_tree, store):
+                last_page_reached = True
+            if page_tree is not None:
+                page_trees[page_url] = page_tree
+        except Exception as e:
+            logger.warning(f"Prefetch failed for {page_url}: {e}")
+            last_page_reached = True
+
+    logger.info(f"Prefetching up to {len(page_urls)} pages from {page_urls[0]}")
+    async with asyncio.TaskGroup() as task_group:
+        for page_url in page_urls:
+            await asyncio.sleep(delay + random.uniform(0, 2))
+            if last_page_reached:
+                break
+            requested_urls.add(page_url)
+            task_group.create_task(fetch_page(page_url))
+
+    return page_trees, requested_urls
+
 async def main_program(session: Optional[ClientSession], store: StoreConfigDataType, database: StoreDatabase) -> Tuple[List[ProductDataType], List[ProductDataType]]:
     """Main program to fetch and process data for a store."""
     url = store['options']['base_url']
@@ -340,6 +494,8 @@ async def main_program(session: Optional[ClientSession], store: StoreConfigDataT
     all_new_products: List[ProductDataType] = []
     all_updated_products: List[ProductDataType] = []
     visited_urls = set()
+    prefetched_pages: Dict[str, html.HtmlElement] = {} # Speculatively fetched pages by URL
+    prefetched_urls: set[str] = set() # URLs requested by the current prefetch batch, fetched or not
 
     try:
         current_url = store['options']["base_url"]
@@ -353,17 +509,17 @@ async def main_program(session: Optional[ClientSession], store: StoreConfigDataT
                     break
 
                 visited_urls.add(current_url)
-                html_content = await try_get_page_content(current_url, session, store=store['options'])
-                if not html_content:
+                page_tree = prefetched_pages.pop(current_url, None)
+                if page_tree is None:
+                    page_tree = await try_get_page_content(current_url, session, store=store['options'])
+                if page_tree is None:
                     logger.error(f"Failed to get content from {current_url} after 3 attempts")
                     success = False
                     break
 
-                tree = html.fromstring(html_content)
-                body = get_body_element(tree)
-
-                # Process items from this page
-                page_items = await extract_items_by_config(body, store['options'])
+                # Release the page tree before syncing and the next fetch
+                page_items, next_url = await extract_page(page_tree, store['options'])
+                del page_tree
 
                 if page_items:
                     # Update products for this page immediately
@@ -378,12 +534,17 @@ async def main_program(session: Optional[ClientSession], store: StoreConfigDataT
                     page_urls = {item["product_url"] for item in page_items}
                     all_product_urls.update(page_urls)
 
-                next_url = await get_next_page_url_by_config(body, store['options'])
                 if not next_url:
                     break
 
+                # Only use prefetched pages the site actually links to; start a new batch otherwise.
+                # A page the batch requested but failed to get is refetched on its own below.
+                if next_url not in prefetched_urls:
+                    prefetched_pages, prefetched_urls = await prefetch_pages(session, store['options'], current_url, next_url)
+
                 current_url = next_url
-                await asyncio.sleep(store['options'].get("delay_between_requests", 5) + random.uniform(0, 2))
+                if current_url not in prefetched_pages:
+                    await asyncio.sleep(store['options'].get("delay_between_requests", 5) + random.uniform(0, 2))
 
             except asyncio.CancelledError:
                 logger.warning("Task cancelled during page fetching...")
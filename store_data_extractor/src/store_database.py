@@ -3,9 +3,8 @@ from typing import Optional, List, Dict, Tuple
 import os
 from datetime import datetime
 import asyncio
-import sys
+import json
 import logging
-sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))) # Add the project root directory to the path
 from utils.helpers import ensure_directory_exists
 from store_data_extractor.store_types import ProductDataType, StoreDataType
 
@@ -13,8 +12,6 @@ from store_data_extractor.store_types import ProductDataType, StoreDataType
 ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')) # Root project directory
 DATA_DIR = os.path.join(ROOT_DIR, "data")  # Data directory
 
-ensure_directory_exists(DATA_DIR)  # Ensure that the data directory exists
-
 SQLITE_STORE_DB_FILE = os.path.join(DATA_DIR, "store_db.sqlite")  # SQLite database file
 
 class StoreDatabase:
@@ -23,7 +20,10 @@ class StoreDatabase:
         self.logger = logging.getLogger("StoreDatabase")
         self.store_db_file_name = SQLITE_STORE_DB_FILE
         self.db_name = "Store Database"
-        self.db_lock = asyncio.Lock()
+        self.db_lock = asyncio.Lock() # Guards every use of the shared connection, sync transactions run in a worker thread
+        self._store_ids: Dict[str, int] = {} # Store name -> id, stores are looked up on every sync
+
+        ensure_directory_exists(os.path.dirname(self.store_db_file_name))  # Ensure that the data directory exists
 
         try:
             self.conn = connect(self.store_db_file_name, isolation_level=None, check_same_thread=False, timeout=30.0)
@@ -41,6 +41,10 @@ class StoreDatabase:
             self.cursor.execute("PRAGMA foreign_keys = ON;")
             self.cursor.execute("PRAGMA busy_timeout = 30000;")
             self.cursor.execute("PRAGMA journal_mode=WAL;")
+            self.cursor.execute("PRAGMA synchronous=NORMAL;")
+            self.cursor.execute("PRAGMA temp_store=MEMORY;")
+            self.cursor.execute("PRAGMA cache_size=-65536;") # 64 MiB page cache
+            self.cursor.execute("PRAGMA mmap_size=268435456;") # 256 MiB memory-mapped reads
             self.cursor.executescript("""
                 CREATE TABLE IF NOT EXISTS Store (
                     id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
@@ -62,295 +66,357 @@ class StoreDatabase:
                     FOREIGN KEY (store_id) REFERENCES Store (id)
                 );
             """)
+            self.remove_duplicate_products()
+            self.cursor.executescript("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_product_store_image_url
+                    ON Product (store_id, image_url, product_url);
+                CREATE INDEX IF NOT EXISTS idx_product_store_url ON Product (store_id, product_url);
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_store_name ON Store (name);
+            """)
             self.logger.info("Database initialized successfully.")
         except Error as e:
             self.logger.error(f"Failed to initialize the database {self.db_name}: {e}")
 
+    def remove_duplicate_products(self) -> None:
+        """Remove duplicate products left by older versions so the unique product index can be created."""
+        index_exists = self.cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_product_store_image_url'"
+        ).fetchone()
+        if index_exists:
+            return
+
+        # Keep the oldest row of each duplicate set, the one the previous per-product update kept current
+        self.cursor.execute("""
+            DELETE FROM Product
+            WHERE id NOT IN (SELECT MIN(id) FROM Product GROUP BY store_id, image_url, product_url)
+        """)
+        if self.cursor.rowcount > 0:
+            self.logger.warning(f"Removed {self.cursor.rowcount} duplicate products before creating the unique product index.")
+
     async def close_connection(self) -> None:
         """Close the database connection."""
         self.logger.info("Closing database connection...")
-        if self.conn:
-            self.conn.close()
+        async with self.db_lock: # Let an in-flight sync transaction finish first
+            if self.conn:
+                self.conn.close()
+
+    def get_store_id(self, name: str) -> Optional[int]:
+        """Return the ID of an existing store, or None if it doesn't exist; the caller must hold db_lock."""
+        if name in self._store_ids:
+            return self._store_ids[name]
+
+        store: Optional[Row] = self.cursor.execute("SELECT id FROM Store WHERE name = ?", (name,)).fetchone()
+        if store is None:
+            return None
+        self._store_ids[name] = int(store["id"])
+        return self._store_ids[name]
 
     def add_store(self, name: str) -> Optional[int]:
         """Add a store to the database if it doesn't exist and return the store ID."""
         try:
-            store: Optional[Row] = self.cursor.execute("SELECT id FROM Store WHERE name = ?", (name,)).fetchone()
-            if store:
-                return int(store["id"])
+            store_id = self.get_store_id(name)
+            if store_id is not None:
+                return store_id
 
             self.logger.info(f"Store '{name}' not found. Creating a new store...")
             self.cursor.execute("INSERT INTO Store (name) VALUES (?)", (name,))
-
-            store_row: Optional[Row] = self.cursor.execute("SELECT id FROM Store WHERE name = ?", (name,)).fetchone()
-            return int(store_row["id"]) if store_row else None
+            if self.cursor.lastrowid is not None:
+                self._store_ids[name] = self.cursor.lastrowid
+            return self.cursor.lastrowid
 
         except Error as e:
             self.logger.error(f"Error adding store '{name}': {e}")
             return None
 
-    async def add_or_update_product(self, name: str, product_url: str, image_url: Optional[str],
-                                     price_jpy: Optional[float], price_eur: Optional[float],
-                                     archived: int, store_name: str, mark_sent: bool = False) -> Tuple[str, Optional[ProductDataType]]:
-        """
-        Add or update a product in the database.
-        Always updates last_seen and archived status.
-        Checks both URL and name to determine if product exists.
-        With mark_sent=True new products are inserted as already sent (used on the
-        initial fetch so a fresh database never floods notification channels).
-        """
-        store_id: Optional[int] = self.add_store(store_name)
-        if store_id is None:
-            self.logger.error(f"Failed to find or create store {store_name}")
-            return "error", None
-
+    async def get_stores(self) -> List[StoreDataType]:
+        """Get all stores from the database."""
         async with self.db_lock:
             try:
-                now = datetime.now()
-                # Check image_url exists, to check if product exists in db
-                db_products: List[Row] = self.cursor.execute(
-                    """
-                    SELECT id, name, product_url, image_url, price_jpy, price_eur
-                    FROM Product
-                    WHERE (image_url = ?)
-                    AND store_id = ?
-                    """,
-                    (image_url, store_id)
-                ).fetchall()
-                # Case 1: No products with this image_url exist - create new product
-                if not db_products:
-                    self.cursor.execute("""
-                        INSERT INTO Product (name, product_url, image_url, price_jpy, price_eur, archived, store_id, first_seen, last_seen, is_sent)
-                                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                                        (name, product_url, image_url, price_jpy, price_eur, archived, store_id, now, now, int(mark_sent)))
-                    if self.cursor.lastrowid is None:
-                        self.logger.error(f"Failed to insert new product '{product_url}'")
-                        return "error", None
-                    new_product: ProductDataType = {
-                        "id": self.cursor.lastrowid,
-                        "name": name,
-                        "product_url": product_url,
-                        "image_url": image_url,
-                        "prices": {
-                            "JPY": price_jpy if price_jpy is not None else None,
-                            "EUR": price_eur if price_eur is not None else None
-                        }
+                rows: List[Row] = self.cursor.execute("SELECT * FROM Store").fetchall()
+                return [
+                    {
+                        "id": row["id"],
+                        "name": row["name"],
+                        "initial_fetch": row["initial_fetch"]
                     }
-                    return "new", new_product
-
-                # Case 2: Products with this image_url exist - check for matching product_url
-                matching_product = None
-                for product in db_products:
-                    if product["product_url"] == product_url:
-                        matching_product = product
-                        break
-
-                # Case 2a: No product with matching URL - create a new instance with same image
-                if matching_product is None:
-                    # check does product_url exist in the list, if not, insert and return update. if product_url exits, update the product and return updated
-                    # New product instance
-                    self.cursor.execute("""
-                        INSERT INTO Product (name, product_url, image_url, price_jpy, price_eur, archived, store_id, first_seen, last_seen, is_sent)
-                                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                                        (name, product_url, image_url, price_jpy, price_eur, archived, store_id, now, now, int(mark_sent)))
-                    if self.cursor.lastrowid is None:
-                        self.logger.error(f"Failed to insert new product '{product_url}'")
-                        return "error", None
-                    updated_product: ProductDataType = {
-                        "id": self.cursor.lastrowid,
-                        "name": name,
-                        "product_url": product_url,
-                        "image_url": image_url,
-                        "prices": {
-                            "JPY": price_jpy if price_jpy is not None else None,
-                            "EUR": price_eur if price_eur is not None else None
-                        }
-                    }
-                    return "updated", updated_product
-
-                # Updates but not alerts
-                # Case 2b: Found product with matching URL - update it
-                product_id = matching_product["id"]
-                self.cursor.execute("""
-                    UPDATE Product
-                    SET price_jpy = ?, price_eur = ?, archived = ?,
-                        last_seen = ?
-                    WHERE id = ?
-                """, (price_jpy, price_eur, archived, now, product_id))
-
-                return "", None
-
+                    for row in rows
+                ]
             except Error as e:
-                self.logger.error(f"Error adding/updating product '{product_url}': {e}")
-                return "error", None
-
-    def get_stores(self) -> List[StoreDataType]:
-        """Get all stores from the database."""
-        try:
-            rows: List[Row] = self.cursor.execute("SELECT * FROM Store").fetchall()
-            return [
-                {
-                    "id": row["id"],
-                    "name": row["name"],
-                    "initial_fetch": row["initial_fetch"]
-                }
-                for row in rows
-            ]
-        except Error as e:
-            self.logger.error(f"Error fetching stores: {e}")
-            return []
+                self.logger.error(f"Error fetching stores: {e}")
+                return []
 
     async def get_products(self, store_name: str) -> List[ProductDataType]:
         """Get all products for a store."""
-        try:
-            store: Optional[Row] = self.cursor.execute("SELECT id FROM Store WHERE name = ?", (store_name,)).fetchone()
-            if store is None:
-                self.logger.error(f"Store '{store_name}' not found.")
-                return []
+        async with self.db_lock:
+            try:
+                store_id = self.get_store_id(store_name)
+                if store_id is None:
+                    self.logger.error(f"Store '{store_name}' not found.")
+                    return []
 
-            store_id: int = store["id"]
-            products: List[Row] = self.cursor.execute(
-                "SELECT id, name, product_url, image_url, price_jpy, price_eur, archived FROM Product WHERE store_id = ?",
-                (store_id,)
-            ).fetchall()
+                products: List[Row] = self.cursor.execute(
+                    "SELECT id, name, product_url, image_url, price_jpy, price_eur, archived FROM Product WHERE store_id = ?",
+                    (store_id,)
+                ).fetchall()
 
-            return [
-                {
-                    "id": product["id"],
-                    "name": product["name"],
-                    "product_url": product["product_url"],
-                    "image_url": product["image_url"],
-                    "prices": {
-                        "JPY": product["price_jpy"] if product["price_jpy"] != 0.0 else None,
-                        "EUR": product["price_eur"] if product["price_eur"] != 0.0 else None
-                    },
-                    "archived": bool(product["archived"])
-                }
-                for product in products
-            ]
-        except Error as e:
-            self.logger.error(f"Error fetching products for store '{store_name}': {e}")
-            return []
+                return [
+                    {
+                        "id": product["id"],
+                        "name": product["name"],
+                        "product_url": product["product_url"],
+                        "image_url": product["image_url"],
+                        "prices": {
+                            "JPY": product["price_jpy"] if product["price_jpy"] != 0.0 else None,
+                            "EUR": product["price_eur"] if product["price_eur"] != 0.0 else None
+                        },
+                        "archived": bool(product["archived"])
+                    }
+                    for product in products
+                ]
+            except Error as e:
+                self.logger.error(f"Error fetching products for store '{store_name}': {e}")
+                return []
 
-    async def get_unsent_products(self, store_name: Optional[str] = None) -> List[ProductDataType]:
-        """Get all products that have not been sent, optionally for a single store."""
-        try:
-            if store_name is not None:
-                products: List[Row] = self.cursor.execute(
+    async def get_urls_to_archive(self, store_name: str, current_urls: set[str]) -> set[str]:
+        """Get URLs of a store's active products that are missing from current_urls."""
+        async with self.db_lock:
+            try:
+                store_id = self.get_store_id(store_name)
+                if store_id is None:
+                    self.logger.error(f"Store '{store_name}' not found.")
+                    return set()
+
+                # Diff in SQL so only the URLs to archive cross into Python
+                rows: List[Row] = self.cursor.execute(
                     """
-                    SELECT p.id, p.name, p.product_url, p.image_url, p.price_jpy, p.price_eur
-                    FROM Product p
-                    JOIN Store s ON s.id = p.store_id
-                    WHERE p.is_sent = 0 AND s.name = ?
+                    SELECT product_url
+                    FROM Product
+                    WHERE store_id = ? AND archived = 0
+                    AND product_url NOT IN (SELECT value FROM json_each(?))
                     """,
-                    (store_name,)
-                ).fetchall()
-            else:
-                products = self.cursor.execute(
-                    "SELECT id, name, product_url, image_url, price_jpy, price_eur FROM Product WHERE is_sent = 0"
+                    (store_id, json.dumps(list(current_urls)))
                 ).fetchall()
 
-            if not products:
-                return []
+                return {row["product_url"] for row in rows}
+            except Error as e:
+                self.logger.error(f"Error fetching products to archive for store '{store_name}': {e}")
+                return set()
 
-            return [
-                {
-                    "id": product["id"],
-                    "name": product["name"],
-                    "product_url": product["product_url"],
-                    "image_url": product["image_url"],
-                    "prices": {
-                        "JPY": product["price_jpy"] if product["price_jpy"] != 0.0 else None,
-                        "EUR": product["price_eur"] if product["price_eur"] != 0.0 else None
+    async def get_unsent_products(self, store_name: Optional[str] = None) -> List[ProductDataType]:
+        """Get all products that have not been sent, optionally for a single store."""
+        async with self.db_lock:
+            try:
+                if store_name is not None:
+                    products: List[Row] = self.cursor.execute(
+                        """
+                        SELECT p.id, p.name, p.product_url, p.image_url, p.price_jpy, p.price_eur
+                        FROM Product p
+                        JOIN Store s ON s.id = p.store_id
+                        WHERE p.is_sent = 0 AND s.name = ?
+                        """,
+                        (store_name,)
+                    ).fetchall()
+                else:
+                    products = self.cursor.execute(
+                        "SELECT id, name, product_url, image_url, price_jpy, price_eur FROM Product WHERE is_sent = 0"
+                    ).fetchall()
+
+                if not products:
+                    return []
+
+                return [
+                    {
+                        "id": product["id"],
+                        "name": product["name"],
+                        "product_url": product["product_url"],
+                        "image_url": product["image_url"],
+                        "prices": {
+                            "JPY": product["price_jpy"] if product["price_jpy"] != 0.0 else None,
+                            "EUR": product["price_eur"] if product["price_eur"] != 0.0 else None
+                        }
                     }
-                }
-                for product in products
-            ]
-        except Error as e:
-            self.logger.error(f"Error fetching unsent products: {e}")
-            return []
+                    for product in products
+                ]
+            except Error as e:
+                self.logger.error(f"Error fetching unsent products: {e}")
+                return []
+
+    async def get_unsent_product_names(self) -> Dict[int, str]:
+        """Get the ids and names of unsent products without building full product dicts."""
+        async with self.db_lock:
+            try:
+                rows: List[Row] = self.cursor.execute("SELECT id, name FROM Product WHERE is_sent = 0").fetchall()
+                return {row["id"]: row["name"] for row in rows}
+            except Error as e:
+                self.logger.error(f"Error fetching unsent products: {e}")
+                return {}
 
     async def sync_store_products(self, store_name: str, current_items: List[ProductDataType]) -> Tuple[List[ProductDataType], List[ProductDataType]]:
         """
-        Add new products to the database and update existing ones.
+        Add new products to the database and update existing ones in a single transaction.
+        Products are matched by image_url and product_url; a new product_url for a known
+        image_url is reported as updated. On the initial fetch new products are inserted
+        as already sent so a fresh database never floods notification channels.
         Returns a tuple of lists: (new_products, updated_products).
         """
-        store_id: Optional[int] = self.add_store(store_name)
-        if store_id is None:
-            self.logger.error(f"Failed to find or create store {store_name}")
-            return [], []
-
-        # Check if this is the first fetch for the store
-        initial_fetch: bool = self.cursor.execute(
-            "SELECT initial_fetch FROM Store WHERE id = ?", (store_id,)
-        ).fetchone()[0] is None
+        async with self.db_lock:
+            store_id: Optional[int] = self.add_store(store_name)
+            if store_id is None:
+                self.logger.error(f"Failed to find or create store {store_name}")
+                return [], []
 
-        if initial_fetch:
-            self.cursor.execute(
-                "UPDATE Store SET initial_fetch = ? WHERE id = ?",
-                (datetime.now(), store_id)
+            self.logger.info(f"Syncing {len(current_items)} products for store {store_name}.")
+            # sqlite3 calls block; run them in a worker thread so other stores keep fetching
+            sync_future = asyncio.ensure_future(
+                asyncio.to_thread(self._sync_store_products, store_id, store_name, current_items)
             )
-            self.logger.info(f"First fetch for {store_name}. Skipping new product notifications.")
-
-        new_products: List[ProductDataType] = []
-        updated_products: List[ProductDataType] = []
-        inserted_count = 0
-        existing_count = 0
-        error_count = 0
-
-        self.logger.info(f"Syncing {len(current_items)} products for store {store_name}.")
-        for item in current_items:
             try:
+                return await asyncio.shield(sync_future)
+            except asyncio.CancelledError:
+                # The thread cannot be stopped; keep db_lock until its transaction ends
+                await sync_future
+                raise
+
+    def _sync_store_products(self, store_id: int, store_name: str, current_items: List[ProductDataType]) -> Tuple[List[ProductDataType], List[ProductDataType]]:
+        """Run the sync transaction for sync_store_products; the caller must hold db_lock."""
+        cursor = self.conn.cursor()
+        now = datetime.now() # One timestamp for the whole batch
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+
+            # Check if this is the first fetch for the store
+            initial_fetch: bool = cursor.execute(
+                "SELECT initial_fetch FROM Store WHERE id = ?", (store_id,)
+            ).fetchone()[0] is None
 
-                name = item["name"].strip()
-                product_url = item["product_url"].strip()
-                image_url = str(item.get("image_url", "")).strip()
-
-                raw_prices = item.get("prices", {})
-                prices: Dict[str, float] = {
-                    key: float(value)
-                    for key, value in raw_prices.items()
-                    if isinstance(value, (int, float))
-                }
-
-                archived: bool = bool(item.get("archived", False))
-                price_jpy = prices.get("JPY", None)
-                price_eur = prices.get("EUR", None)
-
-                product_status, product = await self.add_or_update_product(
-                    name=name,
-                    product_url=product_url,
-                    image_url=image_url,
-                    price_jpy=price_jpy,
-                    price_eur=price_eur,
-                    archived=int(archived),
-                    store_name=store_name,
-                    mark_sent=initial_fetch
+            if initial_fetch:
+                cursor.execute(
+                    "UPDATE Store SET initial_fetch = ? WHERE id = ?",
+                    (now, store_id)
                 )
+                self.logger.info(f"First fetch for {store_name}. Skipping new product notifications.")
 
-                if product_status in ("new", "updated"):
-                    inserted_count += 1
-                elif product_status == "":
-                    existing_count += 1
-                else:
+            # Load the store's products once instead of querying per item
+            existing_rows: List[Row] = cursor.execute(
+                "SELECT id, image_url, product_url, price_jpy, price_eur, archived FROM Product WHERE store_id = ?",
+                (store_id,)
+            ).fetchall()
+            existing_products: Dict[Tuple[str, str], Row] = {
+                (row["image_url"], row["product_url"]): row for row in existing_rows
+            }
+            known_keys: set[Tuple[str, str]] = set(existing_products)
+            known_image_urls: set[str] = {row["image_url"] for row in existing_rows}
+            last_existing_id: int = max((row["id"] for row in existing_rows), default=0)
+
+            product_rows: Dict[Tuple[str, str], List] = {} # Final values per product in this batch
+            inserted_products: Dict[Tuple[str, str], Tuple[str, ProductDataType]] = {}
+            existing_count = 0
+            error_count = 0
+
+            for item in current_items:
+                try:
+                    name = item["name"].strip()
+                    product_url = item["product_url"].strip()
+                    image_url = str(item.get("image_url", "")).strip()
+
+                    raw_prices = item.get("prices", {})
+                    prices: Dict[str, float] = {
+                        key: float(value)
+                        for key, value in raw_prices.items()
+                        if isinstance(value, (int, float))
+                    }
+
+                    archived = int(bool(item.get("archived", False)))
+                    price_jpy = prices.get("JPY", None)
+                    price_eur = prices.get("EUR", None)
+                except Exception as e:
                     error_count += 1
+                    self.logger.error(f"Error processing item {item}: {e}")
+                    continue
 
-                # Check if the product is new and not from the initial fetch
-                if product_status == "new" and product and not initial_fetch:
-                    new_products.append(product)
+                key = (image_url, product_url)
+                if key in product_rows:
+                    # Seen earlier in this batch, later values win like a follow-up update would
+                    product_rows[key][3:] = [price_jpy, price_eur, archived]
+                    existing_count += 1
+                    continue
 
-                # Check updated products
-                elif product_status == "updated" and product and not initial_fetch:
-                    updated_products.append(product)
+                product_rows[key] = [name, product_url, image_url, price_jpy, price_eur, archived]
+                if key in known_keys:
+                    # Updates but not alerts
+                    existing_count += 1
+                    continue
+
+                # A new product_url for a known image_url is an updated product
+                status = "updated" if image_url in known_image_urls else "new"
+                known_keys.add(key)
+                known_image_urls.add(image_url)
+                inserted_products[key] = (status, {
+                    "name": name,
+                    "product_url": product_url,
+                    "image_url": image_url,
+                    "prices": {
+                        "JPY": price_jpy,
+                        "EUR": price_eur
+                    }
+                })
+
+            # Unchanged products only need last_seen bumped; everything else goes through the upsert
+            touched_rows: List[Tuple[datetime, int]] = []
+            upsert_rows: List[Tuple] = []
+            for key, (name, product_url, image_url, price_jpy, price_eur, archived) in product_rows.items():
+                existing = existing_products.get(key)
+                if existing is not None and (existing["price_jpy"], existing["price_eur"], existing["archived"]) == (price_jpy, price_eur, archived):
+                    touched_rows.append((now, existing["id"]))
+                else:
+                    upsert_rows.append((name, product_url, image_url, price_jpy, price_eur, archived,
+                                        store_id, now, now, int(initial_fetch)))
+
+            cursor.executemany("UPDATE Product SET last_seen = ? WHERE id = ?", touched_rows)
+
+            # Inserts new products and refreshes changed ones in one statement per row
+            cursor.executemany("""
+                INSERT INTO Product (name, product_url, image_url, price_jpy, price_eur, archived, store_id, first_seen, last_seen, is_sent)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (store_id, image_url, product_url) DO UPDATE
+                SET price_jpy = excluded.price_jpy, price_eur = excluded.price_eur,
+                    archived = excluded.archived, last_seen = excluded.last_seen
+            """, upsert_rows)
+
+            # AUTOINCREMENT ids only grow, so rows above the preloaded maximum are the ones just inserted
+            inserted_ids: Dict[Tuple[str, str], int] = {
+                (row["image_url"], row["product_url"]): row["id"]
+                for row in cursor.execute(
+                    "SELECT id, image_url, product_url FROM Product WHERE store_id = ? AND id > ?",
+                    (store_id, last_existing_id)
+                ).fetchall()
+            }
+
+            self.conn.commit()
+        except Exception as e:
+            # Any failure after BEGIN IMMEDIATE must end the transaction, or later syncs cannot start one
+            self.logger.error(f"Error syncing products for store {store_name}: {e}")
+            try:
+                self.conn.rollback()
+            except Error as rollback_error:
+                self.logger.error(f"Error rolling back sync for store {store_name}: {rollback_error}")
+            return [], []
 
+        new_products: List[ProductDataType] = []
+        updated_products: List[ProductDataType] = []
 
-            except Exception as e:
-                error_count += 1
-                self.logger.error(f"Error processing item {item}: {e}")
+        # Products from the initial fetch are stored as sent and never reported
+        if not initial_fetch:
+            for key, (status, product) in inserted_products.items():
+                product["id"] = inserted_ids[key]
+                if status == "new":
+                    new_products.append(product)
+                else:
+                    updated_products.append(product)
 
         self.logger.info(
             f"Database sync complete for {store_name}: "
-            f"{inserted_count} inserted, {existing_count} existing/updated, {error_count} errors."
+            f"{len(inserted_products)} inserted, {existing_count} existing/updated, {error_count} errors."
         )
 
         return (new_products, updated_products)
@@ -360,59 +426,63 @@ class StoreDatabase:
         if not urls:
             return
 
-        try:
-            store_id = self.add_store(store_name)
-            if store_id is None:
-                return
+        async with self.db_lock:
+            try:
+                store_id = self.add_store(store_name)
+                if store_id is None:
+                    return
 
-            placeholders = ','.join('?' * len(urls))
-            query = f"""
-                UPDATE Product
-                SET archived = 1, last_seen = ?
-                WHERE store_id = ? AND product_url IN ({placeholders})
-            """
+                placeholders = ','.join('?' * len(urls))
+                query = f"""
+                    UPDATE Product
+                    SET archived = 1, last_seen = ?
+                    WHERE store_id = ? AND product_url IN ({placeholders})
+                """
 
-            params = [datetime.now(), store_id] + urls
-            self.cursor.execute(query, params)
-            self.conn.commit()
+                params = [datetime.now(), store_id] + urls
+                self.cursor.execute(query, params)
+                self.conn.commit()
 
-            rows_affected = self.cursor.rowcount
-            if rows_affected > 0:
-                self.logger.info(f"Marked {rows_affected} products as archived for store {store_name}")
+                rows_affected = self.cursor.rowcount
+                if rows_affected > 0:
+                    self.logger.info(f"Marked {rows_affected} products as archived for store {store_name}")
 
-        except Error as e:
-            self.logger.error(f"Error marking products as archived: {e}")
-            self.conn.rollback()
+            except Error as e:
+                self.logger.error(f"Error marking products as archived: {e}")
+                self.conn.rollback()
 
     async def mark_product_as_sent(self, product_id: int) -> None:
         """Mark a product as sent in db when product is posted."""
-        try:
-            self.cursor.execute(
-                "UPDATE Product SET is_sent = 1 WHERE id = ?",
-                (product_id,)
-            )
-            self.conn.commit()
-        except Error as e:
-            self.logger.error(f"Error marking product {product_id} as sent: {e}")
-            self.conn.rollback()
+        async with self.db_lock:
+            try:
+                self.cursor.execute(
+                    "UPDATE Product SET is_sent = 1 WHERE id = ?",
+                    (product_id,)
+                )
+                self.conn.commit()
+            except Error as e:
+                self.logger.error(f"Error marking product {product_id} as sent: {e}")
+                self.conn.rollback()
 
-    def delete_store(self, store_name: str) -> None:
+    async def delete_store(self, store_name: str) -> None:
         """Delete a store and its products from the database."""
-        try:
-            store_row: Optional[Row] = self.cursor.execute("SELECT id FROM Store WHERE name = ?", (store_name,)).fetchone()
-            if store_row is None:
-                self.logger.error(f"Store '{store_name}' not found.")
-                return
-
-            store_id: int = store_row["id"]
-            self.cursor.execute("DELETE FROM Product WHERE store_id = ?", (store_id,))
-            self.cursor.execute("DELETE FROM Store WHERE id = ?", (store_id,))
-        except Error as e:
-            self.logger.error(f"Error deleting store '{store_name}': {e}")
+        async with self.db_lock:
+            try:
+                store_id = self.get_store_id(store_name)
+                if store_id is None:
+                    self.logger.error(f"Store '{store_name}' not found.")
+                    return
+
+                self.cursor.execute("DELETE FROM Product WHERE store_id = ?", (store_id,))
+                self.cursor.execute("DELETE FROM Store WHERE id = ?", (store_id,))
+                self._store_ids.pop(store_name, None)
+            except Error as e:
+                self.logger.error(f"Error deleting store '{store_name}': {e}")
 
-    def delete_product(self, product_name: str) -> None:
+    async def delete_product(self, product_name: str) -> None:
         """Delete a product from the database."""
-        try:
-            self.cursor.execute("DELETE FROM Product WHERE name = ?", (product_name,))
-        except Error as e:
-            self.logger.error(f"Error deleting product '{product_name}': {e}")
+        async with self.db_lock:
+            try:
+                self.cursor.execute("DELETE FROM Product WHERE name = ?", (product_name,))
+            except Error as e:
+                self.logger.error(f"Error deleting product '{product_name}': {e}")
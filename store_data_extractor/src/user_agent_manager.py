@@ -1,7 +1,7 @@
 import os
-import aiofiles
 import asyncio
-from typing import List, Optional
+import itertools
+from typing import Iterator, List, Optional, Tuple
 import logging
 
 ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
@@ -9,95 +9,126 @@ CONFIG_DIR = os.path.join(ROOT_DIR, "config")
 
 AGENT_LIST_FILE = os.path.join(CONFIG_DIR, "user_agents.txt")
 AGENT_INDEX_FILE = os.path.join(CONFIG_DIR, "last_user_agent_index.txt")
+FLUSH_INTERVAL = 5 # Seconds between index flushes while the session is running
+
+logger = logging.getLogger("UserAgentManager")
 
 class UserAgentManager:
     def __init__(self):
-        self.file_lock = asyncio.Lock()
-        self.index_lock = asyncio.Lock()
+        self.write_lock = asyncio.Lock() # Serializes index file writes, which share one temporary file
         self.user_agent_list: List[str] = self._load_user_agents()
-        self.current_index: Optional[int] = None
-        self.highest_used_index: Optional[int] = None  # Track highest used index
+        self._agent_cycle: Iterator[Tuple[int, str]] = iter(()) # (index, agent) pairs in rotation order
+        self.last_used_index: Optional[int] = None # Index saved to file so a restart skips that agent
         self.dirty = False
-        self.logger = logging.getLogger("UserAgentManager")
+        self._flush_task: Optional[asyncio.Task] = None
+        self.logger = logger
         self._initialize_index()
 
     def _initialize_index(self) -> None:
-        """Read the current index from file, or default to 0."""
+        """Read the last used index from file and start the rotation after it, or at 0."""
+        start_index = 0
         try:
-            with open(AGENT_INDEX_FILE, 'r') as f:
-                loaded_index = int(f.read().strip()) + 1 # prevent using the same agent
-                if loaded_index > len(self.user_agent_list):
-                    self.current_index = 0
-                    self.highest_used_index = 0
-                else:
-                    self.current_index = loaded_index
-                    self.highest_used_index = loaded_index
-        except (FileNotFoundError, ValueError):
-            self.current_index = 0
-            self.highest_used_index = 0
+            # The file holds a single integer, so read it raw without text-mode buffering
+            fd = os.open(AGENT_INDEX_FILE, os.O_RDONLY)
+            try:
+                saved_index = int(os.read(fd, 32))
+            finally:
+                os.close(fd)
+            if 0 <= saved_index < len(self.user_agent_list):
+                self.last_used_index = saved_index
+                start_index = saved_index + 1 # prevent using the same agent
+        except (OSError, ValueError):
+            pass
+
+        agents = itertools.cycle(enumerate(self.user_agent_list))
+        self._agent_cycle = itertools.islice(agents, start_index, None)
 
     def _load_user_agents(self) -> List[str]:
         """Load user agents from file into a list."""
         try:
-            with open(AGENT_LIST_FILE, 'r') as f:
-                return [agent.strip() for agent in f if agent.strip()]
+            # One read and one decode instead of iterating the file line by line
+            with open(AGENT_LIST_FILE, 'rb') as f:
+                lines = f.read().decode().splitlines()
+            return [agent for agent in map(str.strip, lines) if agent]
         except FileNotFoundError:
             raise RuntimeError(f"User agent file not found at {AGENT_LIST_FILE}")
 
-    async def next_user_agent(self) -> str:
-        async with self.index_lock:
-            if self.current_index is None:
-                self.current_index = 0
-
-            # Select agent based on current_index
-            agent = self.user_agent_list[self.current_index % len(self.user_agent_list)]
-
-            # Update highest used index
-            if self.highest_used_index is None or self.current_index > self.highest_used_index:
-                self.highest_used_index = self.current_index
+    def next_user_agent(self) -> str:
+        """Return the next user agent in rotation."""
+        # No lock or await needed: this runs on the event loop thread without yielding
+        self.last_used_index, agent = next(self._agent_cycle)
+        self.dirty = True
 
-            # Increment the index
-            self.current_index += 1
-            self.dirty = True
-
-            return agent
+        return agent
 
     async def save_index_after_task(self, force: bool = False) -> None:
-        """Save the highest used index to file."""
-        # Use highest_used_index instead of current_index
-        if self.highest_used_index is None:
+        """Save the last used index to file."""
+        if self.last_used_index is None:
             return
 
         if not force and not self.dirty:
             return
 
-        max_retries = 5
-        retry_delay = 0.5
-        last_error = None
-
-        async with self.index_lock:
-            for attempt in range(max_retries):
+        async with self.write_lock:
+            # Agents used while the write runs mark the index dirty again for the next flush
+            index = self.last_used_index
+            self.dirty = False
+            write_future = asyncio.ensure_future(asyncio.to_thread(self._write_index_file, str(index)))
+            try:
+                await asyncio.shield(write_future)
+            except asyncio.CancelledError:
+                # The thread cannot be stopped; keep write_lock until it is done so writes never overlap
                 try:
-                    async with self.file_lock:
-                        # Save the highest_used_index instead of current_index
-                        async with aiofiles.open(AGENT_INDEX_FILE, 'w') as f:
-                            await f.write(str(self.highest_used_index))
-                        self.dirty = False
-                        return
+                    await write_future
                 except Exception as e:
-                    last_error = e
-                    if attempt < max_retries - 1:
-                        await asyncio.sleep(retry_delay)
-                        retry_delay *= 2
-
-            self.logger.error(f"Failed to save user agent index after {max_retries} attempts: {last_error}")
+                    self.dirty = True
+                    self.logger.error(f"Failed to save user agent index: {e}")
+                raise
+            except Exception as e:
+                self.dirty = True # Retry on the next flush
+                self.logger.error(f"Failed to save user agent index: {e}")
+
+    @staticmethod
+    def _write_index_file(data: str) -> None:
+        """Atomically replace the index file; run in a worker thread so one hop covers the whole write."""
+        tmp_file = AGENT_INDEX_FILE + ".tmp"
+        with open(tmp_file, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, AGENT_INDEX_FILE) # Readers see the old or the new index, never a partial write
+
+    def start_flush_loop(self) -> None:
+        """Start the background task that periodically saves the index."""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop_flush_loop(self) -> None:
+        """Stop the background flush task and save the index one last time."""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.save_index_after_task(force=True)
+
+    async def _flush_loop(self) -> None:
+        """Save the index at most once per interval, and only when it has changed."""
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await self.save_index_after_task()
+            except Exception as e:
+                self.logger.error(f"Failed to save user agent index: {e}")
 
 # Global instance
 user_agent_manager = UserAgentManager()
 
-async def next_user_agent() -> str:
+def next_user_agent() -> str:
     """Convenience function to get next user agent from the global manager."""
-    return await user_agent_manager.next_user_agent()
+    return user_agent_manager.next_user_agent()
 
 async def save_user_agent_index_after_task(force: bool = False) -> None:
     """Convenience function to save index from the global manager."""
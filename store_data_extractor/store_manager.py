@@ -4,36 +4,52 @@ import aiohttp
 import logging
 import os
 import json
-from store_data_extractor.src.data_extractor import main_program
-from typing import Dict, Optional, List
+from collections import defaultdict
+from urllib.parse import urlsplit
+from store_data_extractor.src.data_extractor import DEFAULT_REQUEST_TIMEOUT, SSL_CONTEXT, main_program
+from store_data_extractor.src.store_database import StoreDatabase
+from store_data_extractor.src.user_agent_manager import user_agent_manager # Shared global instance, not the class
+from typing import Dict, FrozenSet, Optional, List, Union
 from store_data_extractor.store_types import StoreConfigDataType
 
+logger = logging.getLogger("StoreManager")
+
 # Path to the stores configuration file
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config", "stores.json")
 
-store_config: Optional[List[StoreConfigDataType]] = None
-with open(CONFIG_PATH, 'r') as f:
-    store_config = json.load(f)
-
 SEMAPHORE = asyncio.Semaphore(3) # Limit the number of concurrent requests
-
-# Import the global instance instead of the class
-from store_data_extractor.src.user_agent_manager import user_agent_manager
+MAX_CONCURRENT_STORES_PER_HOST = 1 # Stores sharing a host are fetched one at a time
+WILDCARD = "*" # Schedule value matching every hour, day, month or year
+
+def normalize_schedule_value(value: Union[List[int], str]) -> Union[FrozenSet[int], str]:
+    """Convert a schedule list to a set of ints, keeping the wildcard as is."""
+    if value == WILDCARD:
+        return WILDCARD
+    return frozenset(int(item) for item in value)
+
+def load_store_config() -> List[StoreConfigDataType]:
+    """Load the stores configuration file and normalize the schedules once."""
+    with open(CONFIG_PATH, 'r') as f:
+        stores: List[StoreConfigDataType] = json.load(f)
+    for store in stores:
+        store["schedule"] = {field: normalize_schedule_value(value) for field, value in store["schedule"].items()}
+    return stores
 
 class StoreManager:
     """Manage the stores and their data."""
     def __init__(self) -> None:
-        self.stores: Optional[List[StoreConfigDataType]] = store_config
+        self.stores: Optional[List[StoreConfigDataType]] = None # Loaded on first use by _ensure_stores
         self.session = None
-        self.logger = logging.getLogger("StoreManager")
-        from store_data_extractor.src.store_database import StoreDatabase
+        self.logger = logger
         self.db: StoreDatabase = StoreDatabase()
         self.user_agent_manager = user_agent_manager # only one instance of UserAgentManager, prevent multiple instances
         self._shutdown_event = asyncio.Event() # Event to signal shutdown
         self._shutdown_started = False
         self._stopped = False
-        self.current_tasks: List[asyncio.Task] = []
+        self._batch_tasks: set[asyncio.Task] = set() # Batches of store fetches currently running
         self._store_locks: Dict[str, asyncio.Lock] = {} # Prevent concurrent runs for the same store
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {} # Avoid hammering a host shared by several stores
+        self._minute_bucket: Dict[int, List[StoreConfigDataType]] = {} # Minute -> stores scheduled on that minute
 
     def get_store_lock(self, store_name: str) -> asyncio.Lock:
         """Get (or create) the lock that serializes runs for a single store."""
@@ -41,13 +57,57 @@ class StoreManager:
             self._store_locks[store_name] = asyncio.Lock()
         return self._store_locks[store_name]
 
+    def get_host_semaphore(self, url: str) -> asyncio.Semaphore:
+        """Get (or create) the semaphore that limits concurrent runs against a single host."""
+        host = urlsplit(url).netloc
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(MAX_CONCURRENT_STORES_PER_HOST)
+        return self._host_semaphores[host]
+
+
+    def build_minute_bucket(self) -> None:
+        """Index the stores by scheduled minute so a tick only checks the stores due that minute."""
+        if self.stores is None:
+            raise RuntimeError("Store configuration is not loaded")
+
+        minute_bucket: Dict[int, List[StoreConfigDataType]] = defaultdict(list)
+        for store in self.stores:
+            minutes = store["schedule"]["minutes"]
+            if minutes == WILDCARD:
+                continue # "*" not allowed for minutes, the store never matches
+            for minute in minutes:
+                minute_bucket[minute].append(store)
+        self._minute_bucket = dict(minute_bucket)
+
+    async def _ensure_stores(self) -> List[StoreConfigDataType]:
+        """Load the store configuration on first use and return it."""
+        if self.stores is None:
+            stores = await asyncio.to_thread(load_store_config) # Keep file I/O off import and the event loop
+            if self.stores is None: # Another caller may have loaded it while this one waited
+                self.stores = stores
+                self.build_minute_bucket()
+        return self.stores
+
 
     async def start_session(self) -> None:
         """Start a new session."""
         self.logger.info("Starting session...")
         self._stopped = False
+        await self._ensure_stores()
         if not self.session:
-            self.session: Optional[aiohttp.ClientSession] = aiohttp.ClientSession()
+            # One pooled keep-alive connector for the whole process, shared by every store
+            connector = aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=10,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+                ssl=SSL_CONTEXT,
+            )
+            self.session: Optional[aiohttp.ClientSession] = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=DEFAULT_REQUEST_TIMEOUT),
+            )
+        self.user_agent_manager.start_flush_loop() # Index is saved in the background, not after every task
 
 
     async def stop_session(self) -> None:
@@ -88,34 +148,31 @@ class StoreManager:
 
     async def run_startup_tasks(self) -> None:
         """Run stores configured to fetch immediately when the process starts."""
-        tasks = []
-        for store in self.stores or []:
+        stores = []
+        for store in await self._ensure_stores():
             if store.get("run_on_start", False):
                 self.logger.info(f"Running startup task for {store['name']}")
-                tasks.append(asyncio.create_task(self.fetch_store_data(store)))
+                stores.append(store)
 
-        if tasks:
-            await asyncio.gather(*tasks)
+        await self.run_batch(stores)
 
     async def run_scheduled_tasks(self) -> int:
         """Run the scheduled tasks for all stores."""
-        tasks = []
-        for store in self.stores or []:
-            if await self.should_run_now(store):
+        await self._ensure_stores()
+        stores = []
+        now = datetime.now() # One timestamp per tick so every store sees the same minute
+        for store in self._minute_bucket.get(now.minute, ()):
+            if self.should_run_now(store, now):
                 self.logger.info(f"Scheduling task for {store['name']}")
-                tasks.append(asyncio.create_task(self.fetch_store_data(store)))
-
-        # Run all tasks in parallel
-        if tasks:
-            await asyncio.gather(*tasks)
+                stores.append(store)
 
-        return len(tasks)
+        await self.run_batch(stores)
 
+        return len(stores)
 
-    async def should_run_now(self, store: StoreConfigDataType) -> bool:
-        """Check if the store should be updated now."""
 
-        now = datetime.now()
+    def should_run_now(self, store: StoreConfigDataType, now: datetime) -> bool:
+        """Check if the store should be updated at the given time."""
 
         schedule = store["schedule"]
         minutes = schedule["minutes"]   # "*" not allowed
@@ -124,37 +181,61 @@ class StoreManager:
         months = schedule["months"]     # "*" allowed
         years = schedule["years"]       # "*" allowed
 
-        if str(now.minute) not in map(str, minutes):
+        if minutes == WILDCARD or now.minute not in minutes:
             return False
 
-        if hours != "*" and str(now.hour) not in map(str, hours):
+        if hours != WILDCARD and now.hour not in hours:
             return False
 
-        if days != "*" and str(now.day) not in map(str, days):
+        if days != WILDCARD and now.day not in days:
             return False
 
-        if months != "*" and str(now.month) not in map(str, months):
+        if months != WILDCARD and now.month not in months:
             return False
 
-        if years != "*" and str(now.year) not in map(str, years):
+        if years != WILDCARD and now.year not in years:
             return False
 
         return True
 
     async def resend_unsent_products(self) -> None:
         """Resend unsent products to the database."""
-        products = await self.db.get_unsent_products()
+        products = await self.db.get_unsent_product_names()
         if not products:
             return
         self.logger.info("Resending unsent products...")
-        for product in products:
+        for product_id, product_name in products.items():
             try:
-                product_id = product["id"] if "id" in product else None
-                if product_id:
-                    await self.db.mark_product_as_sent(product_id)
-                self.logger.info(f"Product {product['name']} marked as sent.")
+                await self.db.mark_product_as_sent(product_id)
+                self.logger.info(f"Product {product_name} marked as sent.")
             except Exception as e:
-                self.logger.error(f"Failed to mark product {product['name']} as sent: {e}")
+                self.logger.error(f"Failed to mark product {product_name} as sent: {e}")
+
+    async def run_batch(self, stores: List[StoreConfigDataType]) -> None:
+        """Fetch the stores in parallel as one batch task that shutdown can cancel."""
+        if not stores:
+            return
+
+        batch_task = asyncio.create_task(self._run_batch(stores))
+        self._batch_tasks.add(batch_task) # Batches may overlap, e.g. run_all_stores alongside the scheduler
+        try:
+            await batch_task
+        except asyncio.CancelledError:
+            current_task = asyncio.current_task()
+            if current_task and current_task.cancelling():
+                raise # We were cancelled ourselves, not only the batch
+        finally:
+            self._batch_tasks.discard(batch_task)
+
+    async def _run_batch(self, stores: List[StoreConfigDataType]) -> None:
+        """Run one fetch per store in a task group."""
+        # fetch_store_data handles its own errors, so one store failing does not cancel the others
+        try:
+            async with asyncio.TaskGroup() as task_group:
+                for store in stores:
+                    task_group.create_task(self.fetch_store_data(store))
+        except* Exception as e:
+            self.logger.error(f"Error in store batch: {e.exceptions}")
 
     async def fetch_store_data(self, store: StoreConfigDataType) -> None:
         """Fetch and process store data with improved error handling."""
@@ -166,46 +247,33 @@ class StoreManager:
         try:
             await self.resend_unsent_products()
 
-            async with SEMAPHORE:
-                task = asyncio.current_task()
-                if task:
-                    self.current_tasks.append(task)
-
+            # Take the host slot first so waiting on a busy host does not hold a global slot
+            async with self.get_host_semaphore(store['options']['base_url']), SEMAPHORE:
                 result = await main_program(self.session, store, self.db)
                 new_products, updated_products = result
 
                 if new_products:
                     self.logger.info(f"New products found for {store['name']}:")
                     for product in new_products:
-                        self.logger.info(f'New product: {product["name"]}, url: {product["product_url"]}, image: {product["image_url"]}, prices: {product["prices"]}')
+                        self.logger.info("New product: %s, url: %s, image: %s, prices: %s", product["name"], product["product_url"], product["image_url"], product["prices"])
                         product_id = product["id"] if "id" in product else None
                         if product_id:
                             await self.db.mark_product_as_sent(product_id)
-                            self.logger.info(f"Product {product['name']} marked as sent.")
+                            self.logger.info("Product %s marked as sent.", product["name"])
                 if updated_products:
                     self.logger.info(f"Updated products found for {store['name']}:")
                     for product in updated_products:
-                        self.logger.info(f'Updated product: {product["name"]}, url: {product["product_url"]}, image: {product["image_url"]}, prices: {product["prices"]}')
+                        self.logger.info("Updated product: %s, url: %s, image: %s, prices: %s", product["name"], product["product_url"], product["image_url"], product["prices"])
                         product_id = product["id"] if "id" in product else None
                         if product_id:
                             await self.db.mark_product_as_sent(product_id)
-                            self.logger.info(f"Product {product['name']} marked as sent.")
+                            self.logger.info("Product %s marked as sent.", product["name"])
 
         except asyncio.CancelledError:
             self.logger.warning(f"Task cancelled for {store['name']}")
             raise
         except Exception as e:
             self.logger.error(f"Error fetching data for {store['name']}: {e}")
-        finally:
-            try:
-                await self.user_agent_manager.save_index_after_task(force=True)
-            except Exception as e:
-                self.logger.error(f"Failed to save user agent index: {e}")
-
-            # Remove the task from the current tasks list
-            task = asyncio.current_task()
-            if task and task in self.current_tasks:
-                self.current_tasks.remove(task)
 
     async def graceful_shutdown(self) -> None:
         """Initiate graceful shutdown of all operations."""
@@ -216,22 +284,22 @@ class StoreManager:
         self._shutdown_event.set()
         self.logger.info("Initiating graceful shutdown...")
 
-        # Cancel and wait for current tasks to complete
-        current_task = asyncio.current_task()
-        for task in list(self.current_tasks):
-            if task is current_task:
-                continue
-            if not task.done():
-                task.cancel()
-                try:
-                    await task
-                except asyncio.CancelledError:
-                    pass
+        # Cancelling a batch cancels every fetch in its task group; wait for them to unwind
+        batch_tasks = list(self._batch_tasks)
+        for batch_task in batch_tasks:
+            batch_task.cancel()
+        if batch_tasks:
+            await asyncio.gather(*batch_tasks, return_exceptions=True)
+
+        try:
+            await self.user_agent_manager.stop_flush_loop()
+        except Exception as e:
+            self.logger.error(f"Failed to save user agent index: {e}")
 
         await self.stop_session()
 
 
     async def run_all_stores(self) -> None:
         """Fetch data for all stores."""
-        for store in self.stores or []:
-            await self.fetch_store_data(store)
+        # SEMAPHORE and the host limits bound how many run at once
+        await self.run_batch(list(await self._ensure_stores()))
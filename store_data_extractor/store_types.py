@@ -1,4 +1,4 @@
-from typing import Dict, List, NotRequired, Optional, TypedDict, Union
+from typing import Dict, FrozenSet, List, NotRequired, Optional, TypedDict, Union
 
 class StoreOptionsDataType(TypedDict):
     base_url: str
@@ -19,12 +19,13 @@ class StoreOptionsDataType(TypedDict):
     fetch_backend: NotRequired[str]
     curl_impersonate: NotRequired[str]
     request_timeout: NotRequired[float]
+    page_concurrency: NotRequired[int]
 
 class StoreConfigDataType(TypedDict):
     name: str
     name_format: str
     options: StoreOptionsDataType
-    schedule: Dict[str, Union[List[int], str]]
+    schedule: Dict[str, Union[List[int], FrozenSet[int], str]] # Lists are normalized to frozensets on load
     run_on_start: NotRequired[bool]
 
 class StoreDataType(TypedDict):